@@ -2,24 +2,26 @@
 
 from __future__ import annotations
 
+import hashlib
 from functools import wraps
-from typing import Optional, cast
+from pathlib import Path
+from typing import Callable, Optional, cast
 
-from flask import Flask, flash, redirect, render_template, request, send_from_directory, session, url_for
+from flask import Flask, flash, g, make_response, redirect, render_template, request, session, url_for
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.wrappers import Response
 
 from database import (
     create_user,
-    delete_product,
-    delete_user,
-    fetch_orders,
-    fetch_seller_products,
-    fetch_sellers,
-    fetch_users,
+    delete_products,
+    delete_users,
+    fetch_admin_dashboard,
     get_user_by_id,
     get_user_by_username,
     init_db,
+    update_user_password_hash,
 )
-from security import hash_password, validate_password, verify_password
+from security import hash_password, password_needs_rehash, validate_password, verify_login
 
 # Ensure tables exist before the admin panel starts serving requests.
 init_db()
@@ -27,9 +29,27 @@ init_db()
 admin_app = Flask(__name__)
 admin_app.config["SECRET_KEY"] = "dev-secret-key-change-me"
 admin_app.config["SESSION_COOKIE_NAME"] = "gearloom-admin-session"
+admin_app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+_REQUEST_CACHE_SENTINEL = object()
+
+# The service worker only changes on deploy, so read it once instead of on every poll.
+SERVICE_WORKER_PATH = Path(admin_app.static_folder or "static").joinpath("service-worker.js")
+_SERVICE_WORKER_BYTES = SERVICE_WORKER_PATH.read_bytes()
+_SERVICE_WORKER_ETAG = hashlib.sha1(_SERVICE_WORKER_BYTES).hexdigest()
 
 
 def _current_admin() -> Optional[dict[str, object]]:
+    """Return the signed-in admin, looking the user up at most once per request."""
+
+    cached_admin = getattr(g, "_cached_admin", _REQUEST_CACHE_SENTINEL)
+    if cached_admin is not _REQUEST_CACHE_SENTINEL:
+        return cast(Optional[dict[str, object]], cached_admin)
+
+    g._cached_admin = _load_current_admin()
+    return g._cached_admin
+
+
+def _load_current_admin() -> Optional[dict[str, object]]:
     user_id = session.get("admin_user_id")
     if user_id is None:
         return None
@@ -45,12 +65,21 @@ def _current_admin() -> Optional[dict[str, object]]:
     return dict(user)
 
 
+def _dashboard_url() -> str:
+    """Return ``url_for("dashboard")``, building it at most once per request."""
+
+    cached_url = getattr(g, "_dashboard_url", None)
+    if cached_url is None:
+        cached_url = g._dashboard_url = url_for("dashboard")
+    return cached_url
+
+
 def admin_required(view):
     @wraps(view)
     def wrapped(*args, **kwargs):
         if not _current_admin():
             flash("Sign in as an admin to access the console.", "warning")
-            next_url = request.path if request.path else url_for("dashboard")
+            next_url = request.path if request.path else _dashboard_url()
             return redirect(url_for("login", next=next_url))
         return view(*args, **kwargs)
 
@@ -64,6 +93,17 @@ def _form_text(field_name: str, default: str = "") -> str:
     return raw_value.strip()
 
 
+def _form_ids(field_name: str) -> list[int]:
+    """Return every submitted value of a (possibly repeated) id field that parses as an int."""
+    ids: list[int] = []
+    for raw_value in request.form.getlist(field_name):
+        try:
+            ids.append(int(raw_value))
+        except (TypeError, ValueError):
+            continue
+    return ids
+
+
 @admin_app.context_processor
 def inject_admin_user() -> dict[str, object]:
     return {"admin_user": _current_admin()}
@@ -73,25 +113,29 @@ def inject_admin_user() -> dict[str, object]:
 def login():
     """Simple admin-only login tied to the shared user table."""
     if _current_admin():
-        return redirect(url_for("dashboard"))
+        return redirect(_dashboard_url())
 
-    next_url = request.args.get("next", url_for("dashboard"))
+    next_url = request.args.get("next", _dashboard_url())
     if request.method == "POST":
         username = _form_text("username")
         password = request.form.get("password") or ""
         next_url = request.form.get("next") or next_url
 
         user = get_user_by_username(username) if username else None
-        if not user or not user.get("is_admin"):
-            flash("Invalid admin credentials.", "danger")
-        elif not verify_password(password, cast(str, user["password_hash"])):
+        is_admin_user = bool(user and user.get("is_admin"))
+        stored_hash = cast(str, user["password_hash"]) if is_admin_user else None
+        password_ok = verify_login(password, stored_hash)
+        if not (is_admin_user and password_ok):
             flash("Invalid admin credentials.", "danger")
         else:
+            if password_needs_rehash(stored_hash):
+                update_user_password_hash(int(cast(int, user["id"])), hash_password(password))
             session["admin_user_id"] = int(cast(int, user["id"]))
+            g.pop("_cached_admin", None)
             flash("Welcome back.", "success")
             if next_url and next_url.startswith("/"):
                 return redirect(next_url)
-            return redirect(url_for("dashboard"))
+            return redirect(_dashboard_url())
 
     return render_template("admin_login.html", next_url=next_url)
 
@@ -99,15 +143,91 @@ def login():
 @admin_app.route("/logout")
 def logout():
     session.pop("admin_user_id", None)
+    g.pop("_cached_admin", None)
     flash("Signed out of the admin console.", "info")
     return redirect(url_for("login"))
 
 
 @admin_app.route("/service-worker.js")
 def admin_service_worker():
-    """Serve the shared PWA service worker for admin pages."""
-    static_folder = admin_app.static_folder or "static"
-    return send_from_directory(static_folder, "service-worker.js", mimetype="application/javascript")
+    """Serve the shared PWA service worker for admin pages, revalidated via ETag so repeat checks get a 304."""
+    if request.if_none_match.contains(_SERVICE_WORKER_ETAG):
+        response = Response(status=304)
+    else:
+        response = Response(_SERVICE_WORKER_BYTES, mimetype="application/javascript")
+    response.set_etag(_SERVICE_WORKER_ETAG)
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = 0
+    return response
+
+
+def _create_user_account() -> Response:
+    form = request.form
+    username = (form.get("username") or "").strip()
+    password = form.get("password") or ""
+    password_confirm = form.get("password_confirm") or ""
+
+    if not username or not password:
+        flash("Username and password are required.", "warning")
+        return redirect(_dashboard_url())
+    if password != password_confirm:
+        flash("Passwords do not match.", "danger")
+        return redirect(_dashboard_url())
+    if get_user_by_username(username):
+        flash("That username already exists.", "danger")
+        return redirect(_dashboard_url())
+
+    password_error = validate_password(username, password)
+    if password_error:
+        flash(password_error, "warning")
+        return redirect(_dashboard_url())
+
+    password_hash = hash_password(password)
+    create_user(username, password_hash)
+    flash("User account created.", "success")
+    return redirect(_dashboard_url())
+
+
+def _delete_user() -> Response:
+    target_user_ids = _form_ids("user_id")
+    if not target_user_ids:
+        flash("Could not determine which user to delete.", "danger")
+        return redirect(_dashboard_url())
+
+    # admin_required already validated the session id, so no user lookup is needed here.
+    admin_user_id = int(session["admin_user_id"])
+    if admin_user_id in target_user_ids:
+        flash("You cannot delete the currently signed-in admin.", "warning")
+        target_user_ids = [user_id for user_id in target_user_ids if user_id != admin_user_id]
+        if not target_user_ids:
+            return redirect(_dashboard_url())
+
+    delete_users(target_user_ids)
+    flash("User removed." if len(target_user_ids) == 1 else f"{len(target_user_ids)} users removed.", "info")
+    return redirect(_dashboard_url())
+
+
+def _delete_product() -> Response:
+    product_ids = _form_ids("product_id")
+    if not product_ids:
+        flash("Could not resolve the product to delete.", "danger")
+    else:
+        delete_products(product_ids)
+        flash("Product removed." if len(product_ids) == 1 else f"{len(product_ids)} products removed.", "info")
+    return redirect(_dashboard_url())
+
+
+def _unknown_action() -> Response:
+    flash("Unknown admin action.", "warning")
+    return redirect(_dashboard_url())
+
+
+# Dashboard POST handlers keyed by the submitted ``action`` field.
+_DASHBOARD_ACTIONS: dict[str, Callable[[], Response]] = {
+    "create_user_account": _create_user_account,
+    "delete_user": _delete_user,
+    "delete_product": _delete_product,
+}
 
 
 @admin_app.route("/", methods=["GET", "POST"])
@@ -116,88 +236,24 @@ def dashboard():
     """Admin console focused on customers, orders, and account visibility."""
 
     if request.method == "POST":
-        action = request.form.get("action", "")
-
-        if action == "create_user_account":
-            username = _form_text("username")
-            password = request.form.get("password") or ""
-            password_confirm = request.form.get("password_confirm") or ""
-
-            if not username or not password:
-                flash("Username and password are required.", "warning")
-                return redirect(url_for("dashboard"))
-            if password != password_confirm:
-                flash("Passwords do not match.", "danger")
-                return redirect(url_for("dashboard"))
-            if get_user_by_username(username):
-                flash("That username already exists.", "danger")
-                return redirect(url_for("dashboard"))
-
-            password_error = validate_password(username, password)
-            if password_error:
-                flash(password_error, "warning")
-                return redirect(url_for("dashboard"))
-
-            password_hash = hash_password(password)
-            create_user(username, password_hash)
-            flash("User account created.", "success")
-            return redirect(url_for("dashboard"))
-
-        if action == "delete_user":
-            try:
-                target_user_id = int(request.form.get("user_id", ""))
-            except (TypeError, ValueError):
-                flash("Could not determine which user to delete.", "danger")
-                return redirect(url_for("dashboard"))
-
-            admin_user = _current_admin()
-            if admin_user and int(cast(int, admin_user["id"])) == target_user_id:
-                flash("You cannot delete the currently signed-in admin.", "warning")
-                return redirect(url_for("dashboard"))
-
-            delete_user(target_user_id)
-            flash("User removed.", "info")
-            return redirect(url_for("dashboard"))
-
-        if action == "delete_product":
-            try:
-                product_id = int(request.form.get("product_id", ""))
-            except (TypeError, ValueError):
-                flash("Could not resolve the product to delete.", "danger")
-            else:
-                delete_product(product_id)
-                flash("Product removed.", "info")
-            return redirect(url_for("dashboard"))
-
-        flash("Unknown admin action.", "warning")
-        return redirect(url_for("dashboard"))
-
-    sellers = fetch_sellers()
-    users = fetch_users()
-
-    seller_lookup = {seller["user_id"]: seller for seller in sellers}
-    seller_products = {
-        int(seller["id"]): fetch_seller_products(int(seller["id"])) for seller in sellers if isinstance(seller["id"], (int, str))
-    }
-    user_cards: list[dict[str, object]] = []
-    for user in users:
-        seller = seller_lookup.get(user["id"])
-        products = seller_products.get(int(seller["id"])) if seller and isinstance(seller["id"], (int, str)) else []
-        user_cards.append(
-            {
-                "user": user,
-                "seller": seller,
-                "products": products or [],
-            }
-        )
+        handler = _DASHBOARD_ACTIONS.get(request.form.get("action", ""), _unknown_action)
+        return handler()
 
-    orders = fetch_orders()
+    user_cards, orders = fetch_admin_dashboard()
 
-    return render_template(
-        "admin.html",
-        user_cards=user_cards,
-        orders=orders,
+    response = make_response(
+        render_template(
+            "admin.html",
+            user_cards=user_cards,
+            orders=orders,
+        )
     )
+    # Storefront writes happen in another process, so tag the rendered page itself and let
+    # polling admins revalidate; an unchanged page goes back as an empty 304.
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 if __name__ == "__main__":
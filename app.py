@@ -2,61 +2,103 @@
 
 from __future__ import annotations
 
+import hashlib
 import json
-import math
 import os
+import queue
 import random
 import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, List, Mapping, Optional, Union, cast
-from uuid import uuid4
 
 from flask import Flask, abort, flash, g, has_request_context, jsonify, redirect, render_template, request, send_from_directory, session, url_for
+from jinja2 import FileSystemBytecodeCache
+from jinja2.utils import htmlsafe_json_dumps
 
 from werkzeug.wrappers import Response
-from werkzeug.utils import secure_filename
 
 from openai import OpenAI
 
 from database import (
+    bulk_increment_inventory,
+    catalog_version,
+    count_products,
+    fetch_cart_lines,
     create_order,
     create_user,
     create_seller_profile,
     delete_product,
     fetch_product_categories,
-    fetch_product_reviews,
+    fetch_product_review_bundle,
     fetch_products,
-    fetch_products_by_ids,
+    fetch_products_lookup,
     fetch_recent_products_for_user,
     fetch_user_cart,
+    fetch_user_cart_lines,
+    product_image_in_use,
     format_order_reference,
     fetch_orders_for_user,
     get_order,
     get_product,
-    get_product_rating_summary,
     get_seller_by_user_id,
     get_user_by_id,
     get_user_by_username,
-    get_user_review,
+    InsufficientStockError,
     init_db,
     insert_product,
     replace_user_cart,
     update_order,
     update_product,
+    update_user_password_hash,
     upsert_product_review,
     upsert_recent_product_view,
 )
-from security import hash_password, validate_password, verify_password
+from security import hash_password, password_needs_rehash, validate_password, verify_login
 
 # Ensure the database and seed data exist before serving.
 init_db()
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev-secret-key-change-me"
-UPLOAD_DIR = Path(__file__).with_name("static").joinpath("uploads")
+# Werkzeug refuses larger bodies while parsing, before anything is spooled to disk.
+MAX_UPLOAD_BYTES = 8 * 1024 * 1024
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+# Persist compiled template bytecode so a restarted worker skips the lex/parse/compile step.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+STATIC_DIR = Path(__file__).with_name("static")
+UPLOAD_DIR = STATIC_DIR / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
-ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+ALLOWED_IMAGE_EXTENSIONS = frozenset({"png", "jpg", "jpeg", "gif", "webp"})
+_ALLOWED_IMAGE_SUFFIXES = tuple(f".{extension}" for extension in sorted(ALLOWED_IMAGE_EXTENSIONS))
+ALLOWED_IMAGE_MIMETYPES = frozenset({"image/png", "image/jpeg", "image/gif", "image/webp"})
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+WHITESPACE_RUN_PATTERN = re.compile(r"\s+")
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+IMAGE_DELETE_GRACE_SECONDS = 2.0
+PRODUCTS_PER_PAGE = 24
+PRODUCT_STOCK_FILTERS = frozenset({"all", "in", "low", "out"})
+PRODUCT_SORT_OPTIONS = frozenset(
+    {
+        "newest",
+        "oldest",
+        "price_low",
+        "price_high",
+        "inventory_low",
+        "inventory_high",
+        "name_az",
+        "name_za",
+        "rating_high",
+        "rating_low",
+    }
+)
 CHECKOUT_FORM_SESSION_KEY = "checkout_form_data"
+CART_COUNT_SESSION_KEY = "_cart_count"
 CHECKOUT_FORM_FIELDS = (
     "contact_name",
     "contact_email",
@@ -68,8 +110,8 @@ CHECKOUT_FORM_FIELDS = (
     "shipping_country",
     "order_notes",
 )
-EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
-COUNTRY_OPTIONS = [
+_CHECKOUT_FORM_BLANK: dict[str, str] = dict.fromkeys(CHECKOUT_FORM_FIELDS, "")
+COUNTRY_OPTIONS = (
     "United States",
     "Canada",
     "United Kingdom",
@@ -82,8 +124,8 @@ COUNTRY_OPTIONS = [
     "India",
     "Brazil",
     "Mexico",
-]
-REGION_OPTIONS = [
+)
+REGION_OPTIONS = (
     "Alabama",
     "Alaska",
     "Arizona",
@@ -135,10 +177,10 @@ REGION_OPTIONS = [
     "West Virginia",
     "Wisconsin",
     "Wyoming",
-]
-COUNTRY_REGION_MAP: dict[str, list[str]] = {
+)
+COUNTRY_REGION_MAP: dict[str, tuple[str, ...]] = {
     "United States": REGION_OPTIONS,
-    "Canada": [
+    "Canada": (
         "Alberta",
         "British Columbia",
         "Manitoba",
@@ -152,16 +194,16 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Northwest Territories",
         "Nunavut",
         "Yukon",
-    ],
-    "United Kingdom": [
+    ),
+    "United Kingdom": (
         "England",
         "Scotland",
         "Wales",
         "Northern Ireland",
         "Isle of Man",
         "Channel Islands",
-    ],
-    "Germany": [
+    ),
+    "Germany": (
         "Baden-Wurttemberg",
         "Bavaria",
         "Berlin",
@@ -178,8 +220,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Saxony-Anhalt",
         "Schleswig-Holstein",
         "Thuringia",
-    ],
-    "France": [
+    ),
+    "France": (
         "Auvergne-Rhone-Alpes",
         "Bourgogne-Franche-Comte",
         "Bretagne",
@@ -193,8 +235,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Occitanie",
         "Pays de la Loire",
         "Provence-Alpes-Cote d'Azur",
-    ],
-    "Australia": [
+    ),
+    "Australia": (
         "Australian Capital Territory",
         "New South Wales",
         "Northern Territory",
@@ -203,8 +245,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Tasmania",
         "Victoria",
         "Western Australia",
-    ],
-    "New Zealand": [
+    ),
+    "New Zealand": (
         "Auckland",
         "Bay of Plenty",
         "Canterbury",
@@ -221,9 +263,9 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Waikato",
         "Wellington",
         "West Coast",
-    ],
-    "Singapore": ["Singapore"],
-    "Japan": [
+    ),
+    "Singapore": ("Singapore",),
+    "Japan": (
         "Hokkaido",
         "Aomori",
         "Iwate",
@@ -271,8 +313,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Miyazaki",
         "Kagoshima",
         "Okinawa",
-    ],
-    "India": [
+    ),
+    "India": (
         "Andhra Pradesh",
         "Arunachal Pradesh",
         "Assam",
@@ -309,8 +351,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Ladakh",
         "Lakshadweep",
         "Puducherry",
-    ],
-    "Brazil": [
+    ),
+    "Brazil": (
         "Acre",
         "Alagoas",
         "Amapa",
@@ -338,8 +380,8 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Sao Paulo",
         "Sergipe",
         "Tocantins",
-    ],
-    "Mexico": [
+    ),
+    "Mexico": (
         "Aguascalientes",
         "Baja California",
         "Baja California Sur",
@@ -372,8 +414,10 @@ COUNTRY_REGION_MAP: dict[str, list[str]] = {
         "Veracruz",
         "Yucatan",
         "Zacatecas",
-    ],
+    ),
 }
+# Serialised once for the cart page script; the map never changes at runtime.
+COUNTRY_REGION_MAP_JSON = htmlsafe_json_dumps(COUNTRY_REGION_MAP, separators=(",", ":"))
 
 # OpenAI configuration for the AI Project Builder feature.
 OPENAI_KEY_FILE = Path(__file__).with_name("openai_key.txt")
@@ -397,8 +441,28 @@ PROJECT_BUILDER_INTRO = (
 )
 PROJECT_BUILDER_CATALOG_LIMIT = 0
 PROJECT_BUILDER_MAX_QUANTITY = 6
+PROJECT_BUILDER_INSIGHT_KEYS = ("missing", "component_roles", "assembly")
 _openai_client: OpenAI | None = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
 _REQUEST_CACHE_SENTINEL = object()
+# The unfiltered catalogue is shared by the landing page, /products and the project builder.
+# Writes from this process invalidate it immediately; the TTL bounds staleness from the admin app.
+CATALOG_CACHE_TTL_SECONDS = 30.0
+_catalog_cache_lock = threading.Lock()
+_catalog_cache: Dict[str, Any] = {"version": None, "expires_at": 0.0, "products": []}
+_category_cache: Dict[str, Any] = {
+    "version": None,
+    "expires_at": 0.0,
+    "categories": (),
+    "lookup": {},
+    "seller_options": ("General",),
+}
+# Successful project builder answers keyed by (normalised prompt, catalogue version).
+RECOMMENDATION_CACHE_TTL_SECONDS = 600.0
+RECOMMENDATION_CACHE_SIZE = 256
+_recommendation_cache_lock = threading.Lock()
+_recommendation_cache: "OrderedDict[tuple[str, int], tuple[float, Any]]" = OrderedDict()
+# Anonymous renderings of the content pages, keyed by (template, script root).
+_static_page_cache: Dict[tuple[str, str], str] = {}
 
 HERO_VARIANTS: List[Dict[str, str]] = [
     {
@@ -428,35 +492,108 @@ HERO_VARIANTS: List[Dict[str, str]] = [
 ]
 
 
-def _allowed_file(filename: str) -> bool:
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_IMAGE_EXTENSIONS
+def _image_extension(filename: str) -> str:
+    """Return the lowercased extension of an allowed image filename, or ``""``."""
+    lowered = filename.lower()
+    if not lowered.endswith(_ALLOWED_IMAGE_SUFFIXES):
+        return ""
+    return lowered.rpartition(".")[2]
 
 
 def _save_image(file_storage) -> Optional[str]:
-    """Persist an uploaded image with a unique name and return the relative path."""
+    """Persist an uploaded image under its content hash and return the relative path.
+
+    Identical uploads map to the same file, so a re-uploaded photo only costs the hash pass.
+    """
     if not file_storage or not file_storage.filename:
         return None
-    filename = secure_filename(file_storage.filename)
-    if not filename or not _allowed_file(filename):
+    # The stored name is derived from the content, so only the (allow-listed) extension of
+    # the client's filename is ever used and it needs no further sanitising.
+    extension = _image_extension(file_storage.filename)
+    if not extension or file_storage.mimetype not in ALLOWED_IMAGE_MIMETYPES:
         raise ValueError("Please upload a PNG, JPG, GIF, or WEBP image.")
 
-    extension = Path(filename).suffix
-    unique_name = f"{uuid4().hex}{extension}"
-    destination = UPLOAD_DIR / unique_name
-    file_storage.save(destination)
-    return f"uploads/{unique_name}"
+    stream = file_storage.stream
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+
+    stored_name = f"{digest.hexdigest()}.{extension}"
+    destination = UPLOAD_DIR / stored_name
+    # Only complete files ever appear under the final name: the copy goes to a temporary
+    # file first and is renamed into place, so an existing file is always safe to reuse.
+    if not destination.exists():
+        stream.seek(0)
+        temp_fd, temp_name = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-", suffix=".tmp")
+        try:
+            with os.fdopen(temp_fd, "wb") as temp_file:
+                shutil.copyfileobj(stream, temp_file, UPLOAD_CHUNK_SIZE)
+            # mkstemp creates owner-only files; uploads are public static assets.
+            os.chmod(temp_name, 0o644)
+            os.replace(temp_name, destination)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+    return f"uploads/{stored_name}"
+
+
+def _retire_image(image_file: Path, image_path: str) -> None:
+    """Set an unused upload aside, then delete it unless a save reused it in the meantime.
+
+    A save that found the file just before it was moved may commit its product row a moment
+    later, so the in-use check runs again after a grace period and the file is put back if
+    anything references it now.
+    """
+    retired_file = image_file.with_name(f".retired-{image_file.name}")
+    try:
+        os.replace(image_file, retired_file)
+    except FileNotFoundError:
+        return
+    time.sleep(IMAGE_DELETE_GRACE_SECONDS)
+    if product_image_in_use(image_path):
+        os.replace(retired_file, image_file)
+    else:
+        retired_file.unlink(missing_ok=True)
+
+
+def _image_delete_worker() -> None:
+    """Unlink queued upload files so seller requests never wait on the filesystem."""
+    while True:
+        image_path = _image_delete_queue.get()
+        try:
+            # Uploads are content-addressed, so another product may share the same file.
+            if not product_image_in_use(image_path):
+                _retire_image(STATIC_DIR / image_path, image_path)
+        except Exception:
+            app.logger.warning("Could not delete uploaded image %s", image_path, exc_info=True)
+        finally:
+            _image_delete_queue.task_done()
+
+
+_image_delete_queue: "queue.Queue[str]" = queue.Queue()
+threading.Thread(target=_image_delete_worker, name="image-delete", daemon=True).start()
 
 
 def _delete_image(path: Optional[str]) -> None:
+    """Queue an upload for removal; call only after the product row stops referencing it."""
     if not path:
         return
     if not path.startswith("uploads/"):
         return
-    file_path = Path(__file__).with_name("static").joinpath(path)
-    try:
-        file_path.unlink()
-    except FileNotFoundError:
-        return
+    _image_delete_queue.put(path)
+
+
+def _product_form_defaults(product: Mapping[str, object]) -> dict[str, str]:
+    """Return a product's editable fields as the strings blank form inputs fall back to."""
+    return {
+        "name": str(product["name"]),
+        "brand": str(product.get("brand") or ""),
+        "description": str(product.get("description") or ""),
+        "price": str(product["price"]),
+        "sku": str(product.get("sku") or ""),
+        "inventory_count": str(product["inventory_count"]),
+        "category": str(product.get("category") or "General"),
+    }
 
 
 def _parse_numeric_fields(
@@ -498,6 +635,14 @@ def _as_float(value: object, default: float = 0.0) -> float:
     return default
 
 
+def _as_text(value: object) -> str:
+    """Return a stripped string, skipping the str() call when already text."""
+
+    if isinstance(value, str):
+        return value.strip()
+    return str(value or "").strip()
+
+
 def _form_text(field_name: str, default: str = "") -> str:
     """Trim whitespace from form submissions while providing a default."""
     raw_value = request.form.get(field_name)
@@ -506,11 +651,26 @@ def _form_text(field_name: str, default: str = "") -> str:
     return raw_value.strip()
 
 
+def _safe_next_url() -> str:
+    """Return the requested post-login redirect if it is a same-site path, otherwise ''."""
+    candidate = request.args.get("next") or request.form.get("next") or ""
+    # "//host" and "/\host" are protocol-relative to browsers, so only single-slash paths pass.
+    if candidate.startswith("/") and not candidate.startswith(("//", "/\\")):
+        return candidate
+    return ""
+
+
 def _is_valid_email(value: str) -> bool:
     """Basic validation to ensure the string resembles an email address."""
-    if not value:
-        return False
-    return bool(EMAIL_PATTERN.match(value))
+    local_part, at_sign, domain = value.partition("@")
+    return (
+        bool(local_part and at_sign)
+        and "@" not in domain
+        # A dot with at least one character on either side somewhere in the domain.
+        and "." in domain[1:-1]
+        # No whitespace anywhere.
+        and value.split() == [value]
+    )
 
 
 def _current_user() -> Mapping[str, object] | None:
@@ -521,29 +681,26 @@ def _current_user() -> Mapping[str, object] | None:
         if cached_user is not _REQUEST_CACHE_SENTINEL:
             return cast(Optional[Mapping[str, object]], cached_user)
 
+    user = _load_session_user()
+    if has_request_context():
+        g._cached_user = user
+        g._cached_user_id = int(cast(int, user["id"])) if user else None
+    return user
+
+
+def _load_session_user() -> Mapping[str, object] | None:
+    """Look up the user referenced by the session, dropping ids that no longer resolve."""
+
     user_id = session.get("user_id")
     if user_id is None:
-        if has_request_context():
-            g._cached_user = None
         return None
     try:
-        user_id_int = int(user_id)
+        user = get_user_by_id(int(user_id))
     except (TypeError, ValueError):
-        session.pop("user_id", None)
-        session.pop("username", None)
-        if has_request_context():
-            g._cached_user = None
-        return None
-
-    user = get_user_by_id(user_id_int)
+        user = None
     if not user:
         session.pop("user_id", None)
         session.pop("username", None)
-        if has_request_context():
-            g._cached_user = None
-        return None
-    if has_request_context():
-        g._cached_user = user
     return user
 
 
@@ -551,15 +708,18 @@ def _current_user_id() -> int | None:
     """Return the authenticated user id if present."""
 
     if has_request_context():
-        cached_id = getattr(g, "_cached_user_id", _REQUEST_CACHE_SENTINEL)
-        if cached_id is not _REQUEST_CACHE_SENTINEL:
-            return cast(Optional[int], cached_id)
+        _current_user()
+        return cast(Optional[int], g._cached_user_id)
 
     user = _current_user()
-    user_id_value = int(cast(int, user["id"])) if user else None
-    if has_request_context():
-        g._cached_user_id = user_id_value
-    return user_id_value
+    return int(cast(int, user["id"])) if user else None
+
+
+def _reset_user_cache() -> None:
+    """Forget per-request user, seller, and cart lookups after the signed-in identity changes."""
+
+    for attr in ("_cached_user", "_cached_user_id", "_cached_seller", "_cached_cart", "_cached_cart_user_id"):
+        g.pop(attr, None)
 
 
 def _current_seller() -> Mapping[str, object] | None:
@@ -594,22 +754,27 @@ def _get_cart() -> Dict[int, int]:
         cart = fetch_user_cart(user_id)
     else:
         session_cart_raw = session.get("cart")
-        session_cart = session_cart_raw if isinstance(session_cart_raw, dict) else {}
+        # Guest carts are stored as [[product_id, quantity], ...]; older cookies still hold a dict.
+        if isinstance(session_cart_raw, list):
+            entries: Any = session_cart_raw
+        elif isinstance(session_cart_raw, dict):
+            entries = session_cart_raw.items()
+        else:
+            entries = ()
         cart = {}
-        for pid, qty in (session_cart or {}).items():
+        for entry in entries:
             try:
+                pid, qty = entry
+                product_id = int(pid)
                 quantity = int(qty)
             except (TypeError, ValueError):
                 continue
-            if quantity <= 0:
-                continue
-            try:
-                cart[int(pid)] = quantity
-            except (TypeError, ValueError):
-                continue
+            if quantity > 0:
+                cart[product_id] = quantity
 
     if has_request_context():
         g._cached_cart = dict(cart)
+        g._cached_cart_user_id = user_id
     return cart
 
 
@@ -628,66 +793,135 @@ def _store_cart(cart: Dict[int, int]) -> None:
         normalized[pid] = qty
 
     user_id = _current_user_id()
+    # Skip the database write and session re-sign when this request already loaded the
+    # same cart for the same shopper and nothing changed.
+    if (
+        has_request_context()
+        and getattr(g, "_cached_cart_user_id", _REQUEST_CACHE_SENTINEL) == user_id
+        and getattr(g, "_cached_cart", None) == normalized
+        and CART_COUNT_SESSION_KEY in session
+    ):
+        return
+
+    # Signed-in carts live in the database; only a non-empty guest cart rides in the cookie.
     if user_id:
         replace_user_cart(user_id, normalized)
-        session["cart"] = {}
+        session.pop("cart", None)
+    elif normalized:
+        session["cart"] = [[pid, qty] for pid, qty in normalized.items()]
     else:
-        session["cart"] = normalized
+        session.pop("cart", None)
+    session[CART_COUNT_SESSION_KEY] = sum(normalized.values())
 
     if has_request_context():
         g._cached_cart = dict(normalized)
+        g._cached_cart_user_id = user_id
     session.modified = True
 
 
+def _cart_item_count() -> int:
+    """Return the basket badge count without loading the cart when it is known.
+
+    A cart this request already loaded wins over the session count, which another
+    session of the same user may have made stale.
+    """
+
+    cached_cart = getattr(g, "_cached_cart", _REQUEST_CACHE_SENTINEL)
+    if cached_cart is not _REQUEST_CACHE_SENTINEL:
+        return sum(cast(Dict[int, int], cached_cart).values())
+    cached_count = session.get(CART_COUNT_SESSION_KEY)
+    if isinstance(cached_count, int):
+        return cached_count
+    if not session.get("cart") and not _current_user_id():
+        return 0
+    return sum(_get_cart().values())
+
+
 def _cart_snapshot(cart: Optional[Dict[int, int]] = None) -> tuple[list[dict[str, object]], float]:
     """Return hydrated cart items with pricing."""
 
-    active_cart = dict(cart) if cart is not None else _get_cart()
-    if not active_cart:
-        return [], 0.0
+    user_id = _current_user_id() if cart is None else None
+    if user_id and getattr(g, "_cached_cart", _REQUEST_CACHE_SENTINEL) is _REQUEST_CACHE_SENTINEL:
+        # Nothing has loaded the saved cart yet, so price it straight from the cart table.
+        lines, total = fetch_user_cart_lines(user_id)
+    else:
+        # Only read from here on, so the caller's mapping is used as-is.
+        active_cart = cart if cart is not None else _get_cart()
+        if not active_cart:
+            _remember_cart_count(0)
+            return [], 0.0
+
+        quantity_lookup: Dict[int, int] = {}
+        for raw_product_id, raw_quantity in active_cart.items():
+            try:
+                product_id = int(raw_product_id)
+                quantity = int(raw_quantity)
+            except (TypeError, ValueError):
+                continue
+            quantity_lookup[product_id] = quantity_lookup.get(product_id, 0) + max(0, quantity)
 
-    ordered_ids: list[int] = []
-    quantity_lookup: Dict[int, int] = {}
-    for raw_product_id, raw_quantity in active_cart.items():
-        try:
-            product_id = int(raw_product_id)
-            quantity = int(raw_quantity)
-        except (TypeError, ValueError):
-            continue
-        if product_id not in quantity_lookup:
-            ordered_ids.append(product_id)
-        quantity_lookup[product_id] = quantity_lookup.get(product_id, 0) + max(0, quantity)
+        lines, total = fetch_cart_lines(quantity_lookup)
+    items: list[dict[str, object]] = [
+        {
+            "product": line,
+            "quantity": line["quantity"],
+            "line_total": line["line_total"],
+        }
+        for line in lines
+    ]
+    # The lines were just read from the database, so refresh the badge count from them.
+    _remember_cart_count(sum(_as_int(line["quantity"]) for line in lines))
 
-    products = fetch_products_by_ids(ordered_ids)
-    product_lookup = {int(product["id"]) if isinstance(product["id"], (int, str)) else None: product for product in products if isinstance(product["id"], (int, str))}
-    items: list[dict[str, object]] = []
-    total = 0.0
+    return items, round(total, 2)
 
-    for product_id in ordered_ids:
-        product = product_lookup.get(product_id)
-        if not product:
+
+def _remember_cart_count(count: int) -> None:
+    """Store the badge count in the session, re-signing the cookie only when it changed."""
+
+    if session.get(CART_COUNT_SESSION_KEY) != count:
+        session[CART_COUNT_SESSION_KEY] = count
+
+
+def _reconcile_cart_stock(cart: Dict[int, int], items: list[dict[str, object]]) -> list[str]:
+    """Clamp or drop cart lines that current stock cannot cover, returning shopper notices.
+
+    ``items`` is a fresh ``_cart_snapshot`` of ``cart``; products missing from it no longer
+    exist and are removed as well. ``cart`` is updated in place.
+    """
+
+    messages: list[str] = []
+    listed: set[int] = set()
+    for entry in items:
+        product = entry.get("product")
+        if not isinstance(product, Mapping):
             continue
-        quantity = max(0, quantity_lookup.get(product_id, 0))
-        if quantity <= 0:
+        product_id = _as_int(product.get("id"))
+        available_stock = _as_int(product.get("inventory_count"))
+        requested = _as_int(entry.get("quantity", 0))
+        if product_id <= 0:
             continue
-        price = float(product["price"]) if isinstance(product["price"], (int, float, str)) else 0.0
-        line_total = price * quantity
-        total += line_total
-        items.append(
-            {
-                "product": product,
-                "quantity": quantity,
-                "line_total": line_total,
-            }
-        )
+        listed.add(product_id)
+        if available_stock <= 0:
+            cart.pop(product_id, None)
+            messages.append(f"{product['name']} is no longer in stock and was removed from your cart.")
+        elif requested > available_stock:
+            cart[product_id] = available_stock
+            messages.append(
+                f"{product['name']} has only {available_stock} in stock. Your cart was updated to the maximum."
+            )
 
-    return items, round(total, 2)
+    missing = [product_id for product_id in cart if product_id not in listed]
+    for product_id in missing:
+        del cart[product_id]
+    if missing:
+        messages.append("Items that are no longer sold were removed from your cart.")
+    return messages
 
 
 def _checkout_form_defaults() -> dict[str, str]:
     """Return the most recent checkout form attempt or sensible defaults."""
 
-    defaults = {field: "" for field in CHECKOUT_FORM_FIELDS}
+    defaults = _CHECKOUT_FORM_BLANK.copy()
     saved = session.pop(CHECKOUT_FORM_SESSION_KEY, None)
     if isinstance(saved, dict):
         for field in CHECKOUT_FORM_FIELDS:
@@ -707,9 +941,8 @@ def _checkout_form_defaults() -> dict[str, str]:
 def _remember_checkout_form_submission() -> None:
     """Persist the latest checkout form values so the template can refill them."""
 
-    session[CHECKOUT_FORM_SESSION_KEY] = {
-        field: request.form.get(field, "") for field in CHECKOUT_FORM_FIELDS
-    }
+    form_get = request.form.get
+    session[CHECKOUT_FORM_SESSION_KEY] = {field: form_get(field, "") for field in CHECKOUT_FORM_FIELDS}
 
 
 def _restock_order_inventory(order: Mapping[str, object]) -> None:
@@ -719,6 +952,7 @@ def _restock_order_inventory(order: Mapping[str, object]) -> None:
     if not isinstance(items, list):
         return
 
+    restock: Dict[int, int] = {}
     for entry in items:
         if not isinstance(entry, Mapping):
             continue
@@ -731,38 +965,144 @@ def _restock_order_inventory(order: Mapping[str, object]) -> None:
             continue
         if pid <= 0 or qty <= 0:
             continue
-        product = get_product(pid)
-        if not product:
-            continue
-        current_inventory = max(_as_int(product.get("inventory_count")), 0)
-        update_product(pid, inventory_count=current_inventory + qty)
+        restock[pid] = restock.get(pid, 0) + qty
+
+    bulk_increment_inventory(restock)
 
 
 def _safe_load_recommendation_json(raw_text: str) -> dict[str, Any]:
     """Extract JSON content from an LLM response, trimming any surrounding prose."""
 
-    try:
-        return json.loads(raw_text)
-    except json.JSONDecodeError:
-        start = raw_text.find("{")
-        end = raw_text.rfind("}")
-        if start == -1 or end == -1 or end <= start:
-            raise ValueError("Model response did not include JSON data.")
-        snippet = raw_text[start : end + 1]
-        return json.loads(snippet)
+    text = raw_text.strip()
+    if text.startswith("{") and text.endswith("}"):
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            pass
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end == -1 or end <= start:
+        raise ValueError("Model response did not include JSON data.")
+    return json.loads(text[start : end + 1])
 
 
+@lru_cache(maxsize=2048)
 def _short_description(text: str, limit: int = 140) -> str:
     """Return a single-line excerpt for UI display."""
 
-    cleaned = re.sub(r"\s+", " ", text or "").strip()
+    cleaned = WHITESPACE_RUN_PATTERN.sub(" ", text or "").strip()
     if len(cleaned) <= limit:
         return cleaned
     return f"{cleaned[:limit].rstrip()}…"
 
 
+def _cached_catalog() -> List[Mapping[str, object]]:
+    """Return the unfiltered, newest-first catalogue, re-reading it at most once per TTL.
+
+    The returned list is shared between requests and must not be mutated.
+    """
+
+    version = catalog_version()
+    now = time.monotonic()
+    with _catalog_cache_lock:
+        if _catalog_cache["version"] == version and now < _catalog_cache["expires_at"]:
+            return cast(List[Mapping[str, object]], _catalog_cache["products"])
+
+    products = list(fetch_products())
+    with _catalog_cache_lock:
+        _catalog_cache.update(version=version, expires_at=now + CATALOG_CACHE_TTL_SECONDS, products=products)
+    return products
+
+
+def _cached_categories() -> tuple[tuple[str, ...], Mapping[str, str], tuple[str, ...]]:
+    """Return the categories, their lower-case lookup, and the seller form's options.
+
+    Refreshed on the same version/TTL schedule as the catalogue.
+    """
+
+    version = catalog_version()
+    now = time.monotonic()
+    with _catalog_cache_lock:
+        if _category_cache["version"] == version and now < _category_cache["expires_at"]:
+            return _category_cache["categories"], _category_cache["lookup"], _category_cache["seller_options"]
+
+    categories = tuple(fetch_product_categories())
+    lookup = {category.lower(): category for category in categories}
+    seller_options = categories if "General" in categories else ("General", *categories)
+    with _catalog_cache_lock:
+        _category_cache.update(
+            version=version,
+            expires_at=now + CATALOG_CACHE_TTL_SECONDS,
+            categories=categories,
+            lookup=lookup,
+            seller_options=seller_options,
+        )
+    return categories, lookup, seller_options
+
+
+def _builder_catalog_json(
+    products: List[Mapping[str, object]],
+    catalog_slice: List[Mapping[str, object]],
+) -> str:
+    """Return the compact catalog_data JSON for the builder prompt, serialised once per catalogue."""
+
+    with _catalog_cache_lock:
+        if _catalog_cache.get("builder_json_source") is products:
+            return cast(str, _catalog_cache["builder_json"])
+
+    catalog_payload = [
+        {
+            "id": int(str(prod["id"])),
+            "name": prod["name"],
+            "category": prod.get("category"),
+            "brand": prod.get("brand"),
+            "description": prod.get("description"),
+            "price": float(str(prod.get("price") or 0)),
+            "inventory_count": int(str(prod.get("inventory_count") or 0)),
+        }
+        for prod in catalog_slice
+    ]
+    catalog_json = json.dumps(catalog_payload, separators=(",", ":"))
+    with _catalog_cache_lock:
+        # Only remember it while ``products`` is still the cached catalogue.
+        if _catalog_cache["products"] is products:
+            _catalog_cache.update(builder_json_source=products, builder_json=catalog_json)
+    return catalog_json
+
+
 def _generate_project_builder_recommendations(
     prompt: str,
+) -> tuple[list[dict[str, Union[int, str]]], dict[str, str], Optional[str]]:
+    """Return builder recommendations, reusing a recent answer for the same brief and catalogue.
+
+    Quantities are clamped again against live stock when the items are hydrated, so a
+    cached answer never oversells.
+    """
+
+    cache_key = (" ".join((prompt or "").lower().split()), catalog_version())
+    now = time.monotonic()
+    with _recommendation_cache_lock:
+        cached = _recommendation_cache.get(cache_key)
+        if cached and cached[0] > now:
+            _recommendation_cache.move_to_end(cache_key)
+            items, insights = cached[1]
+            return [dict(item) for item in items], dict(insights), None
+
+    items, insights, error = _request_project_builder_recommendations(prompt)
+    if error is None:
+        with _recommendation_cache_lock:
+            _recommendation_cache[cache_key] = (
+                now + RECOMMENDATION_CACHE_TTL_SECONDS,
+                ([dict(item) for item in items], dict(insights)),
+            )
+            _recommendation_cache.move_to_end(cache_key)
+            while len(_recommendation_cache) > RECOMMENDATION_CACHE_SIZE:
+                _recommendation_cache.popitem(last=False)
+    return items, insights, error
+
+
+def _request_project_builder_recommendations(
+    prompt: str,
 ) -> tuple[list[dict[str, Union[int, str]]], dict[str, str], Optional[str]]:
     """Call the OpenAI Responses API to map a project brief to catalog product ids."""
 
@@ -770,7 +1110,7 @@ def _generate_project_builder_recommendations(
     if not prompt_text:
         return [], {}, "Describe your project so the builder can help."
 
-    products = list(fetch_products())
+    products = _cached_catalog()
     if not products:
         return [], {}, "No products are available to recommend right now."
 
@@ -785,18 +1125,7 @@ def _generate_project_builder_recommendations(
             "Set the OPENAI_API_KEY environment variable (or add openai_key.txt) to enable AI recommendations.",
         )
 
-    catalog_payload = [
-        {
-            "id": int(str(prod["id"])),
-            "name": prod["name"],
-            "category": prod.get("category"),
-            "brand": prod.get("brand"),
-            "description": prod.get("description"),
-            "price": float(str(prod.get("price") or 0)),
-            "inventory_count": int(str(prod.get("inventory_count") or 0)),
-        }
-        for prod in catalog_slice
-    ]
+    catalog_json = _builder_catalog_json(products, catalog_slice)
 
     message_payload = [
         {
@@ -826,7 +1155,7 @@ def _generate_project_builder_recommendations(
             "content": [
                 {
                     "type": "input_text",
-                    "text": f"catalog_data={json.dumps(catalog_payload, separators=(',', ':'))}",
+                    "text": f"catalog_data={catalog_json}",
                 },
                 {"type": "input_text", "text": f"project_prompt={prompt_text}"},
             ],
@@ -834,7 +1163,13 @@ def _generate_project_builder_recommendations(
     ]
 
     try:
-        response = _openai_client.responses.create(model=OPENAI_MODEL, input=json.dumps(message_payload), temperature=0.2)
+        # JSON mode keeps the model from spending tokens on prose around the payload.
+        response = _openai_client.responses.create(
+            model=OPENAI_MODEL,
+            input=json.dumps(message_payload),
+            temperature=0.2,
+            text={"format": {"type": "json_object"}},
+        )
     except Exception:
         app.logger.exception("OpenAI request failed for the project builder.")
         return [], {}, "We couldn't reach the AI recommender. Please try again."
@@ -888,15 +1223,14 @@ def _generate_project_builder_recommendations(
         if normalized_qty <= 0:
             continue
 
-        note = str(entry.get("notes") or "").strip()
+        note = _as_text(entry.get("notes"))
         items.append({"product_id": product_id, "quantity": normalized_qty, "notes": note})
 
-    insights_raw = parsed.get("insights") or {}
-    insights = {
-        "missing": str(insights_raw.get("missing") or "").strip(),
-        "component_roles": str(insights_raw.get("component_roles") or "").strip(),
-        "assembly": str(insights_raw.get("assembly") or "").strip(),
-    }
+    insights_raw = parsed.get("insights")
+    if isinstance(insights_raw, Mapping) and insights_raw:
+        insights = {key: _as_text(insights_raw.get(key)) for key in PROJECT_BUILDER_INSIGHT_KEYS}
+    else:
+        insights = dict.fromkeys(PROJECT_BUILDER_INSIGHT_KEYS, "")
 
     if not items:
         return [], insights, "No matching products were available for that project."
@@ -918,12 +1252,7 @@ def _hydrate_recommendations(recommendations: list[dict[str, int]]) -> tuple[lis
         if pid:
             normalized_ids.append(pid)
 
-    products = fetch_products_by_ids(normalized_ids)
-    product_lookup: dict[int, Mapping[str, object]] = {}
-    for prod in products:
-        pid = _as_int(prod.get("id"))
-        if pid:
-            product_lookup[pid] = prod
+    product_lookup = fetch_products_lookup(normalized_ids)
 
     hydrated: list[dict[str, object]] = []
     subtotal = 0.0
@@ -959,16 +1288,23 @@ def _hydrate_recommendations(recommendations: list[dict[str, int]]) -> tuple[lis
     return hydrated, subtotal
 
 
+@app.errorhandler(413)
+def request_too_large(_error) -> Response:
+    """Send oversized uploads back to the form with a readable message."""
+    flash(f"Uploads must be {MAX_UPLOAD_BYTES // (1024 * 1024)} MB or smaller.", "danger")
+    referrer = request.referrer or ""
+    if referrer.startswith(request.host_url):
+        return redirect(referrer)
+    return redirect(url_for("index"))
+
+
 @app.context_processor
 def inject_cart_meta() -> Dict[str, object]:
     """Expose cart statistics and user details to every template."""
-    cart = _get_cart()
-    total_items = sum(cart.values())
-
     current_user = _current_user()
 
     return {
-        "cart_item_count": total_items,
+        "cart_item_count": _cart_item_count(),
         "current_user": current_user,
         "current_seller": _current_seller(),
     }
@@ -977,11 +1313,11 @@ def inject_cart_meta() -> Dict[str, object]:
 @app.route("/")
 def index() -> str:
     """Landing page with a snapshot of highlighted products."""
-    products = list(fetch_products())
+    products = _cached_catalog()
     sample_count = min(4, len(products))
     featured_products: List[Mapping[str, object]] = random.sample(products, sample_count) if sample_count else []
 
-    left_count = math.ceil(sample_count / 2) if sample_count else 0
+    left_count = (sample_count + 1) // 2
     left_products = featured_products[:left_count]
     right_products = featured_products[left_count:]
 
@@ -1043,21 +1379,23 @@ def project_builder_add_to_cart():
     if not isinstance(raw_items, list) or not raw_items:
         return jsonify({"success": False, "error": "No items were provided."}), 400
 
-    cart = _get_cart()
-    additions: list[dict[str, object]] = []
-    warnings: list[str] = []
-
+    requested: list[tuple[int, int]] = []
     for entry in raw_items:
         try:
             product_id = int(entry["product_id"])
             quantity = int(entry["quantity"])
         except (KeyError, TypeError, ValueError):
             continue
+        if quantity > 0:
+            requested.append((product_id, quantity))
 
-        if quantity <= 0:
-            continue
+    product_lookup = fetch_products_lookup(product_id for product_id, _ in requested)
+    cart = _get_cart()
+    additions: list[dict[str, object]] = []
+    warnings: list[str] = []
 
-        product = get_product(product_id)
+    for product_id, quantity in requested:
+        product = product_lookup.get(product_id)
         if not product:
             warnings.append(f"Product {product_id} is no longer available.")
             continue
@@ -1096,36 +1434,70 @@ def project_builder_add_to_cart():
     return jsonify({"success": False, "error": error_message, "warnings": warnings, "cart_item_count": sum(cart.values())})
 
 
+def _render_static_page(template_name: str) -> str:
+    """Render a content page, reusing the anonymous rendering when nothing is per-visitor.
+
+    The navbar shows the signed-in user and cart badge and the layout drains pending
+    flashes, so only visitors with none of those share the cached HTML.
+    """
+
+    if app.debug or _current_user_id() or _cart_item_count() or "_flashes" in session:
+        return render_template(template_name)
+
+    cache_key = (template_name, request.script_root)
+    cached_html = _static_page_cache.get(cache_key)
+    if cached_html is None:
+        cached_html = _static_page_cache[cache_key] = render_template(template_name)
+    return cached_html
+
+
 @app.route("/about")
 def about() -> str:
     """Static page with brand context."""
-    return render_template("about.html")
+    return _render_static_page("about.html")
 
 
 @app.route("/help")
 def help_center() -> str:
     """Customer support landing page."""
-    return render_template("help.html")
+    return _render_static_page("help.html")
 
 
 @app.route("/returns")
 def returns_policy() -> str:
     """Return and exchange policy."""
-    return render_template("returns.html")
+    return _render_static_page("returns.html")
 
 
 @app.route("/shipping")
 def shipping_info() -> str:
     """Shipping and delivery details."""
-    return render_template("shipping.html")
+    return _render_static_page("shipping.html")
+
+
+@app.route("/static/uploads/<path:filename>")
+def uploaded_image(filename: str) -> Response:
+    """Serve product uploads as immutable: their names are content hashes."""
+    response = send_from_directory(UPLOAD_DIR, filename, max_age=UPLOAD_CACHE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route("/service-worker.js")
 def service_worker() -> Response:
-    """Serve the PWA service worker script from the static directory."""
+    """Serve the PWA service worker script, revalidated via ETag so repeat checks get a 304."""
     if not app.static_folder:
         abort(500, description="Static folder is not configured.")
-    return send_from_directory(app.static_folder, "service-worker.js", mimetype="application/javascript")
+    response = send_from_directory(
+        app.static_folder,
+        "service-worker.js",
+        mimetype="application/javascript",
+        max_age=0,
+        conditional=True,
+    )
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.route("/.well-known/appspecific/com.chrome.devtools.json")
@@ -1141,11 +1513,11 @@ def signup() -> str | Response:
         flash("You're already signed in.", "info")
         return redirect(url_for("index"))
 
+    next_url = _safe_next_url()
     if request.method == "POST":
         username = (request.form.get("username") or "").strip()
         password = request.form.get("password") or ""
         password_confirm = request.form.get("password_confirm") or ""
-        next_url = request.args.get("next") or request.form.get("next")
 
         if not username or not password:
             flash("Username and password are required.", "warning")
@@ -1170,14 +1542,12 @@ def signup() -> str | Response:
 
         session["user_id"] = new_user_id
         session["username"] = username
+        _reset_user_cache()
         _store_cart(guest_cart)
 
         flash("Welcome aboard! You're signed in.", "success")
-        if next_url and next_url.startswith("/"):
-            return redirect(next_url)
-        return redirect(url_for("index"))
+        return redirect(next_url or url_for("index"))
 
-    next_url = request.args.get("next", "")
     return render_template("signup.html", next_url=next_url)
 
 
@@ -1188,33 +1558,41 @@ def login() -> str | Response:
         flash("You're already signed in.", "info")
         return redirect(url_for("index"))
 
+    next_url = _safe_next_url()
     if request.method == "POST":
         username = (request.form.get("username") or "").strip()
         password = request.form.get("password") or ""
-        next_url = request.args.get("next") or request.form.get("next")
 
         user = get_user_by_username(username) if username else None
-        if not user or not verify_password(password, cast(str, user["password_hash"])):
+        stored_hash = cast(str, user["password_hash"]) if user else None
+        password_ok = verify_login(password, stored_hash)
+        if not (user and password_ok):
             flash("Invalid username or password.", "danger")
             return render_template("login.html", username=username, next_url=next_url)
 
-        guest_cart = _get_cart()
-        user_cart = fetch_user_cart(int(cast(int, user["id"])))
+        signed_in_id = int(cast(int, user["id"]))
+        if password_needs_rehash(stored_hash):
+            update_user_password_hash(signed_in_id, hash_password(password))
 
-        merged_cart: Dict[int, int] = dict(user_cart)
-        for product_id, qty in guest_cart.items():
-            merged_cart[product_id] = merged_cart.get(product_id, 0) + qty
+        guest_cart = _get_cart()
+        user_cart = fetch_user_cart(signed_in_id)
 
-        session["user_id"] = int(cast(int, user["id"]))
+        session["user_id"] = signed_in_id
         session["username"] = user["username"]
-        _store_cart(merged_cart)
+        _reset_user_cache()
+        if guest_cart:
+            merged_cart: Dict[int, int] = dict(user_cart)
+            for product_id, qty in guest_cart.items():
+                merged_cart[product_id] = merged_cart.get(product_id, 0) + qty
+            _store_cart(merged_cart)
+        else:
+            # Nothing to merge, so the saved cart is already current; only the badge count is new.
+            session.pop("cart", None)
+            session[CART_COUNT_SESSION_KEY] = sum(user_cart.values())
 
         flash("Signed in successfully.", "success")
-        if next_url and next_url.startswith("/"):
-            return redirect(next_url)
-        return redirect(url_for("index"))
+        return redirect(next_url or url_for("index"))
 
-    next_url = request.args.get("next", "")
     return render_template("login.html", next_url=next_url)
 
 
@@ -1224,7 +1602,9 @@ def logout() -> Response:
     session.pop("user_id", None)
     session.pop("username", None)
     session.pop("cart", None)
+    session.pop(CART_COUNT_SESSION_KEY, None)
     session.modified = True
+    _reset_user_cache()
     flash("You have been signed out.", "info")
     return redirect(url_for("index"))
 
@@ -1237,25 +1617,10 @@ def products() -> str:
     sort_raw = (request.args.get("sort") or "newest").lower()
     category_raw = (request.args.get("category") or "all").strip()
 
-    allowed_stock = {"all", "in", "low", "out"}
-    stock = stock_raw if stock_raw in allowed_stock else "all"
+    stock = stock_raw if stock_raw in PRODUCT_STOCK_FILTERS else "all"
+    sort = sort_raw if sort_raw in PRODUCT_SORT_OPTIONS else "newest"
 
-    allowed_sort = {
-        "newest",
-        "oldest",
-        "price_low",
-        "price_high",
-        "inventory_low",
-        "inventory_high",
-        "name_az",
-        "name_za",
-        "rating_high",
-        "rating_low",
-    }
-    sort = sort_raw if sort_raw in allowed_sort else "newest"
-
-    available_categories = fetch_product_categories() or []
-    normalized_categories = {cat.lower(): cat for cat in available_categories}
+    available_categories, normalized_categories, _ = _cached_categories()
     category_key = category_raw.lower()
     if category_key in normalized_categories:
         category = normalized_categories[category_key]
@@ -1264,28 +1629,56 @@ def products() -> str:
     else:
         category = "all"
 
-    catalogue = list(
-        fetch_products(
-            search=search or None,
-            stock_filter=stock if stock != "all" else None,
-            sort=sort,
-            category=category if category != "all" else None,
+    page = max(_as_int(request.args.get("page"), 1), 1)
+    has_active = bool(search or stock != "all" or sort != "newest" or category != "all")
+    if has_active:
+        filter_kwargs: Dict[str, Any] = {
+            "search": search or None,
+            "stock_filter": stock if stock != "all" else None,
+            "category": category if category != "all" else None,
+        }
+        result_count = count_products(**filter_kwargs)
+        page_count = max((result_count + PRODUCTS_PER_PAGE - 1) // PRODUCTS_PER_PAGE, 1)
+        page = min(page, page_count)
+        catalogue = list(
+            fetch_products(
+                sort=sort,
+                limit=PRODUCTS_PER_PAGE,
+                offset=(page - 1) * PRODUCTS_PER_PAGE,
+                **filter_kwargs,
+            )
         )
-    )
+    else:
+        full_catalogue = _cached_catalog()
+        result_count = len(full_catalogue)
+        page_count = max((result_count + PRODUCTS_PER_PAGE - 1) // PRODUCTS_PER_PAGE, 1)
+        page = min(page, page_count)
+        catalogue = full_catalogue[(page - 1) * PRODUCTS_PER_PAGE : page * PRODUCTS_PER_PAGE]
     user_id = _current_user_id()
     recently_viewed = fetch_recent_products_for_user(user_id, limit=3) if user_id else []
+    page_args: Dict[str, Any] = {}
+    if search:
+        page_args["search"] = search
+    if stock != "all":
+        page_args["stock"] = stock
+    if sort != "newest":
+        page_args["sort"] = sort
+    if category != "all":
+        page_args["category"] = category
     filters = {
         "search": search,
         "stock": stock,
         "sort": sort,
         "category": category if category != "all" else "all",
-        "has_active": bool(
-            search or stock != "all" or sort != "newest" or category != "all"
-        ),
-        "result_count": len(catalogue),
+        "has_active": has_active,
+        "result_count": result_count,
+        "page": page,
+        "page_count": page_count,
+        "prev_url": url_for("products", page=page - 1, **page_args) if page > 1 else None,
+        "next_url": url_for("products", page=page + 1, **page_args) if page < page_count else None,
     }
 
-    category_options = ["All"] + available_categories
+    category_options = ["All", *available_categories]
 
     return render_template(
         "products.html",
@@ -1308,13 +1701,14 @@ def product_detail(product_id: int) -> Union[str, Response]:
         upsert_recent_product_view(user_id, product_id, max_items=3)
 
     if request.method == "POST":
-        form_type = request.form.get("form_type", "add_to_cart")
+        form = request.form
+        form_type = form.get("form_type", "add_to_cart")
         if form_type == "review":
             if not user_id:
                 flash("Sign in to leave a review.", "warning")
                 return redirect(url_for("login", next=url_for("product_detail", product_id=product_id)))
-            rating_raw = request.form.get("rating", "")
-            comment = (request.form.get("comment") or "").strip()
+            rating_raw = form.get("rating", "")
+            comment = (form.get("comment") or "").strip()
             try:
                 rating_value = int(rating_raw)
             except (TypeError, ValueError):
@@ -1330,7 +1724,7 @@ def product_detail(product_id: int) -> Union[str, Response]:
             login_target = url_for("login", next=url_for("product_detail", product_id=product_id))
             return redirect(login_target)
 
-        quantity_raw = request.form.get("quantity", "1")
+        quantity_raw = form.get("quantity", "1")
         try:
             quantity_value = max(1, int(quantity_raw))
         except (TypeError, ValueError):
@@ -1338,8 +1732,7 @@ def product_detail(product_id: int) -> Union[str, Response]:
             return redirect(url_for("product_detail", product_id=product_id))
 
         cart = _get_cart()
-        inventory_value = product.get("inventory_count")
-        available_stock = int(inventory_value) if isinstance(inventory_value, (int, str)) and str(inventory_value).isdigit() else 0
+        available_stock = _as_int(product.get("inventory_count"))
         if available_stock <= 0:
             flash("This product is currently out of stock.", "warning")
             return redirect(url_for("product_detail", product_id=product_id))
@@ -1364,9 +1757,7 @@ def product_detail(product_id: int) -> Union[str, Response]:
         _store_cart(cart)
         return redirect(url_for("cart"))
 
-    rating_summary = get_product_rating_summary(product_id)
-    reviews = fetch_product_reviews(product_id)
-    user_review = get_user_review(product_id, user_id) if user_id else None
+    rating_summary, reviews, user_review = fetch_product_review_bundle(product_id, user_id)
 
     return render_template(
         "product_detail.html",
@@ -1386,10 +1777,8 @@ def seller_dashboard() -> str | Response:
         return redirect(url_for("login", next=url_for("seller_dashboard")))
 
     seller = _current_seller()
-    category_options_raw = fetch_product_categories()
-    category_options: list[str] = list(dict.fromkeys(category_options_raw))
-    if "General" not in category_options:
-        category_options.insert(0, "General")
+    seller_id = int(cast(int, seller["id"])) if seller else None
+    category_options = _cached_categories()[2]
     create_form = {
         "name": "",
         "brand": "",
@@ -1419,6 +1808,7 @@ def seller_dashboard() -> str | Response:
                         description=description or None,
                         contact_email=contact_email or None,
                     )
+                    g.pop("_cached_seller", None)
                     flash("Seller profile created. You can now add products.", "success")
                     return redirect(url_for("seller_dashboard"))
 
@@ -1466,7 +1856,7 @@ def seller_dashboard() -> str | Response:
                             inventory_count=inventory_value if inventory_value is not None else 0,
                             image_path=image_path,
                             category=category_value,
-                            seller_id=int(cast(int, seller["id"])),
+                            seller_id=seller_id,
                         )
                         flash("Product added to your catalogue.", "success")
                         return redirect(url_for("seller_dashboard"))
@@ -1482,27 +1872,26 @@ def seller_dashboard() -> str | Response:
                 return redirect(url_for("seller_dashboard"))
 
             product = get_product(product_id)
-            seller_id = int(cast(int, seller["id"]))
             seller_id_value = product.get("seller_id") if product else None
             if not product or not isinstance(seller_id_value, (int, str)) or int(seller_id_value) != seller_id:
                 flash("You can only manage products that belong to you.", "danger")
                 return redirect(url_for("seller_dashboard"))
 
             if action == "delete_product":
-                _delete_image(cast(Optional[str], product.get("image_path")))
                 delete_product(product_id)
+                _delete_image(cast(Optional[str], product.get("image_path")))
                 flash("Product removed.", "info")
                 return redirect(url_for("seller_dashboard"))
 
             # Update flow
-            name = _form_text("name") or str(product["name"])
-            brand_value = _form_text("brand") or str(product.get("brand", ""))
-            description = _form_text("description") or str(product["description"])
-            price_raw = _form_text("price") or f"{product['price']}"
-            sku = _form_text("sku") or cast(Optional[str], product.get("sku"))
-            inventory_raw = _form_text("inventory_count") or str(product["inventory_count"])
-            category_value = _form_text("category") or str(product.get("category", "General"))
-            price_value, inventory_value, numeric_error = _parse_numeric_fields(price_raw, inventory_raw)
+            form = request.form
+            fields = {
+                key: (form.get(key) or "").strip() or default
+                for key, default in _product_form_defaults(product).items()
+            }
+            price_value, inventory_value, numeric_error = _parse_numeric_fields(
+                fields["price"], fields["inventory_count"]
+            )
             if numeric_error:
                 flash(numeric_error, "warning")
                 return redirect(url_for("seller_dashboard"))
@@ -1514,37 +1903,30 @@ def seller_dashboard() -> str | Response:
                 flash(str(exc), "warning")
                 return redirect(url_for("seller_dashboard"))
 
-            image_path = current_image
-            if new_image:
-                if current_image and current_image != new_image:
-                    _delete_image(current_image)
-                image_path = new_image
-
             update_product(
                 product_id,
-                name=name,
-                brand=brand_value,
-                description=description,
-                price=price_value if price_value is not None else float(str(product["price"])),
-                sku=sku,
-                inventory_count=inventory_value if inventory_value is not None else int(str(product["inventory_count"])),
-                image_path=image_path,
-                category=category_value,
+                name=fields["name"],
+                brand=fields["brand"],
+                description=fields["description"],
+                price=price_value,
+                sku=fields["sku"] or None,
+                inventory_count=inventory_value,
+                image_path=new_image or current_image,
+                category=fields["category"],
             )
+            if new_image and current_image != new_image:
+                _delete_image(current_image)
             flash("Product updated.", "success")
             return redirect(url_for("seller_dashboard"))
 
         else:
             flash("Unknown seller action.", "warning")
 
-    seller_refresh = _current_seller()
-    seller_products = []
-    if seller_refresh:
-        seller_products = list(fetch_products(seller_id=int(cast(int, seller_refresh["id"]))))
+    seller_products = list(fetch_products(seller_id=seller_id)) if seller_id else []
 
     return render_template(
         "seller_dashboard.html",
-        seller=seller_refresh,
+        seller=seller,
         create_form=create_form,
         products=seller_products,
         category_options=category_options,
@@ -1557,7 +1939,7 @@ def cart() -> str:
     items, total = _cart_snapshot()
     checkout_defaults = _checkout_form_defaults()
     selected_country = checkout_defaults.get("shipping_country") or "United States"
-    region_options = COUNTRY_REGION_MAP.get(selected_country, [])
+    region_options = COUNTRY_REGION_MAP.get(selected_country, ())
     return render_template(
         "cart.html",
         items=items,
@@ -1565,7 +1947,7 @@ def cart() -> str:
         checkout_defaults=checkout_defaults,
         country_options=COUNTRY_OPTIONS,
         region_options=region_options,
-        region_map=COUNTRY_REGION_MAP,
+        region_map_json=COUNTRY_REGION_MAP_JSON,
     )
 
 
@@ -1631,21 +2013,16 @@ def checkout():
     shipping_country = _form_text("shipping_country") or "United States"
     order_notes = _form_text("order_notes")
 
-    errors: list[str] = []
-    if not contact_name:
-        errors.append("Enter the recipient name so we can address the shipment.")
-    if not contact_email or not _is_valid_email(contact_email):
-        errors.append("Provide a valid email address for order updates.")
-    if not address_line_one:
-        errors.append("Add a shipping address line.")
-    if not shipping_city:
-        errors.append("Specify the city for delivery.")
-    if not shipping_postal:
-        errors.append("Postal or ZIP code is required.")
-    if not shipping_country:
-        errors.append("Include the destination country.")
-    if not shipping_region:
-        errors.append("Select the state or region for the destination.")
+    field_checks = (
+        (contact_name, "Enter the recipient name so we can address the shipment."),
+        (_is_valid_email(contact_email), "Provide a valid email address for order updates."),
+        (address_line_one, "Add a shipping address line."),
+        (shipping_city, "Specify the city for delivery."),
+        (shipping_postal, "Postal or ZIP code is required."),
+        (shipping_country, "Include the destination country."),
+        (shipping_region, "Select the state or region for the destination."),
+    )
+    errors = [message for passed, message in field_checks if not passed]
     allowed_regions = COUNTRY_REGION_MAP.get(shipping_country)
     if allowed_regions and shipping_region and shipping_region not in allowed_regions:
         errors.append("Pick a region that matches the selected country.")
@@ -1656,25 +2033,7 @@ def checkout():
             flash(message, "warning")
         return redirect(url_for("cart"))
 
-    inventory_messages: list[str] = []
-    for entry in items:
-        product = entry.get("product")
-        if not isinstance(product, Mapping):
-            continue
-        product_id = _as_int(product.get("id"))
-        available_stock = _as_int(product.get("inventory_count"))
-        requested = _as_int(entry.get("quantity", 0))
-        if product_id <= 0:
-            continue
-        if available_stock <= 0:
-            cart.pop(product_id, None)
-            inventory_messages.append(f"{product['name']} is no longer in stock and was removed from your cart.")
-        elif requested > available_stock:
-            cart[product_id] = available_stock
-            inventory_messages.append(
-                f"{product['name']} has only {available_stock} in stock. Your cart was updated to the maximum."
-            )
-
+    inventory_messages = _reconcile_cart_stock(cart, items)
     if inventory_messages:
         _store_cart(cart)
         _remember_checkout_form_submission()
@@ -1719,32 +2078,35 @@ def checkout():
     seller_id_value = seller_ids.pop() if len(seller_ids) == 1 else None
     total_amount = round(total, 2)
 
-    order_id = create_order(
-        user_id=user_id,
-        seller_id=seller_id_value,
-        status="pending",
-        total_amount=total_amount,
-        notes=order_notes or None,
-        contact_name=contact_name,
-        contact_email=contact_email,
-        shipping_address=shipping_address,
-        shipping_city=shipping_city,
-        shipping_region=shipping_region or None,
-        shipping_postal=shipping_postal,
-        shipping_country=shipping_country,
-        items=order_items_payload,
-    )
-
-    for entry in items:
-        product = entry.get("product")
-        if not isinstance(product, Mapping):
-            continue
-        product_id = _as_int(product.get("id"))
-        if product_id <= 0:
-            continue
-        available_stock = _as_int(product.get("inventory_count"))
-        new_inventory = max(0, available_stock - _as_int(entry.get("quantity", 0)))
-        update_product(product_id, inventory_count=new_inventory)
+    try:
+        order_id = create_order(
+            user_id=user_id,
+            seller_id=seller_id_value,
+            status="pending",
+            total_amount=total_amount,
+            notes=order_notes or None,
+            contact_name=contact_name,
+            contact_email=contact_email,
+            shipping_address=shipping_address,
+            shipping_city=shipping_city,
+            shipping_region=shipping_region or None,
+            shipping_postal=shipping_postal,
+            shipping_country=shipping_country,
+            items=order_items_payload,
+            decrement_inventory=True,
+        )
+    except InsufficientStockError as exc:
+        # Stock moved (or a product vanished) after the snapshot above; re-check against
+        # the current catalogue so the shopper lands on a cart that has actually been fixed.
+        fresh_items, _ = _cart_snapshot(cart)
+        inventory_messages = _reconcile_cart_stock(cart, fresh_items)
+        _store_cart(cart)
+        _remember_checkout_form_submission()
+        for message in inventory_messages or [str(exc)]:
+            flash(message, "warning")
+        if inventory_messages:
+            flash("Review the updated cart before checking out.", "warning")
+        return redirect(url_for("cart"))
 
     _store_cart({})
     session.pop(CHECKOUT_FORM_SESSION_KEY, None)
@@ -2,13 +2,17 @@
 
 from __future__ import annotations
 
+import json
 from contextlib import contextmanager
 from datetime import datetime
+from itertools import count, groupby
 from pathlib import Path
 from typing import Dict, Iterable, Iterator, Mapping, Optional, Sequence
 
 from sqlalchemy import (
     Boolean,
+    CTE,
+    ColumnElement,
     DateTime,
     Float,
     ForeignKey,
@@ -19,12 +23,15 @@ from sqlalchemy import (
     asc,
     desc,
     and_,
+    case,
     create_engine,
     delete,
+    event,
     func,
     or_,
     select,
     cast,
+    literal,
     update,
 )
 from sqlalchemy.orm import (
@@ -76,6 +83,28 @@ engine = create_engine(
 )
 SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    # Sorts, window functions and CTEs spill to RAM instead of temp files.
+    "PRAGMA temp_store=MEMORY",
+    # Negative values are KiB: keep ~20 MB of pages hot per pooled connection.
+    "PRAGMA cache_size=-20000",
+)
+
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """Apply the WAL/mmap pragmas once per pooled DBAPI connection."""
+
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
 
 class Base(DeclarativeBase):
     """Declarative base for all ORM models."""
@@ -277,11 +306,18 @@ def _serialize_seller(seller: Optional[Seller]) -> Optional[dict[str, object]]:
 # --------------------------------------------------------------------------------------
 
 
+_initialized = False
+
+
 def init_db() -> None:
-    """Create tables and seed demo content."""
+    """Create tables and seed demo content once per process."""
 
+    global _initialized
+    if _initialized:
+        return
     Base.metadata.create_all(bind=engine)
     seed_data()
+    _initialized = True
 
 
 def seed_data() -> None:
@@ -347,6 +383,9 @@ def seed_data() -> None:
                     )
                 )
 
+        # The session does not autoflush, so make the seed users visible to the lookups below.
+        session.flush()
+
         seller_count = session.scalar(select(func.count(Seller.id))) or 0
         if seller_count == 0:
             demo_user = session.execute(select(User).where(User.username == "gearloom_lab")).scalar_one_or_none()
@@ -431,6 +470,22 @@ def seed_data() -> None:
 # Product helpers
 # --------------------------------------------------------------------------------------
 
+# Bumped by every helper that changes what a product row reads back as (product fields,
+# seller name, rating aggregates) so in-process catalogue caches know to refresh.
+_catalog_versions = count(1)
+_catalog_version = 0
+
+
+def catalog_version() -> int:
+    """Return a counter that changes whenever this process writes catalogue data."""
+
+    return _catalog_version
+
+
+def _bump_catalog_version() -> None:
+    global _catalog_version
+    _catalog_version = next(_catalog_versions)
+
 
 def _product_select() -> tuple[Select, object, object]:
     """Return the base select for product queries with rating aggregates."""
@@ -498,19 +553,18 @@ def insert_product(
                 seller_id=seller_id,
             )
         )
+    _bump_catalog_version()
 
 
-def fetch_products(
+def _product_filters(
     *,
     search: Optional[str] = None,
     stock_filter: Optional[str] = None,
-    sort: str = "newest",
     category: Optional[str] = None,
     seller_id: Optional[int] = None,
-) -> Iterable[Mapping[str, object]]:
-    """Return products ordered according to the requested sort and filters."""
+) -> list:
+    """Build the WHERE clauses shared by product listings and counts."""
 
-    stmt, avg_rating_expr, review_count_expr = _product_select()
     filters = []
 
     if search:
@@ -539,6 +593,23 @@ def fetch_products(
     if seller_id is not None:
         filters.append(Product.seller_id == seller_id)
 
+    return filters
+
+
+def fetch_products(
+    *,
+    search: Optional[str] = None,
+    stock_filter: Optional[str] = None,
+    sort: str = "newest",
+    category: Optional[str] = None,
+    seller_id: Optional[int] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> Iterable[Mapping[str, object]]:
+    """Return products ordered according to the requested sort and filters."""
+
+    stmt, avg_rating_expr, review_count_expr = _product_select()
+    filters = _product_filters(search=search, stock_filter=stock_filter, category=category, seller_id=seller_id)
     if filters:
         stmt = stmt.where(and_(*filters))
 
@@ -562,35 +633,117 @@ def fetch_products(
         }
         stmt = stmt.order_by(*order_map.get(sort, order_map["newest"]))
 
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    if offset:
+        stmt = stmt.offset(offset)
+
     with session_scope() as session:
         rows = session.execute(stmt).mappings().all()
         return [dict(row) for row in rows]
 
 
-def fetch_products_by_ids(product_ids: Iterable[int]) -> list[Mapping[str, object]]:
-    """Return products for the provided ids preserving the original order."""
+def count_products(
+    *,
+    search: Optional[str] = None,
+    stock_filter: Optional[str] = None,
+    category: Optional[str] = None,
+    seller_id: Optional[int] = None,
+) -> int:
+    """Return how many products match the filters without loading the rows."""
+
+    stmt = select(func.count(Product.id))
+    filters = _product_filters(search=search, stock_filter=stock_filter, category=category, seller_id=seller_id)
+    if filters:
+        stmt = stmt.where(and_(*filters))
+
+    with session_scope() as session:
+        return int(session.scalar(stmt) or 0)
 
-    seen: set[int] = set()
-    ordered_ids: list[int] = []
+
+def fetch_products_lookup(product_ids: Iterable[int]) -> dict[int, Mapping[str, object]]:
+    """Return the requested products keyed by id, fetched with a single IN query."""
+
+    normalized_ids: set[int] = set()
     for product_id in product_ids:
         try:
-            pid = int(product_id)
+            normalized_ids.add(int(product_id))
         except (TypeError, ValueError):
             continue
-        if pid not in seen:
-            ordered_ids.append(pid)
-            seen.add(pid)
 
-    if not ordered_ids:
-        return []
+    if not normalized_ids:
+        return {}
 
     stmt, _, _ = _product_select()
-    stmt = stmt.where(Product.id.in_(ordered_ids))
+    stmt = stmt.where(Product.id.in_(normalized_ids))
 
     with session_scope() as session:
         rows = session.execute(stmt).mappings().all()
-        lookup = {int(row["id"]): dict(row) for row in rows}
-    return [lookup[pid] for pid in ordered_ids if pid in lookup]
+        return {int(row["id"]): dict(row) for row in rows}
+
+
+def fetch_cart_lines(cart: Mapping[int, int]) -> tuple[list[dict[str, object]], float]:
+    """Return cart lines (product columns plus ``quantity`` and ``line_total``) and the total.
+
+    The cart is sent as a single JSON parameter that SQLite unpacks with ``json_each``, so
+    every line and the basket total are priced in one query however large the cart is;
+    lines keep the cart's order and unknown products drop out.
+    """
+
+    cart_rows = [
+        [_as_int(product_id), _as_int(quantity)]
+        for product_id, quantity in cart.items()
+        if _as_int(quantity) > 0
+    ]
+    if not cart_rows:
+        return [], 0.0
+
+    # json_each numbers array elements from 0 in ``key``, which doubles as the cart position.
+    cart_json = func.json_each(literal(json.dumps(cart_rows))).table_valued("key", "value")
+    cart_lines = select(
+        cart_json.c.key.label("position"),
+        cast(func.json_extract(cart_json.c.value, "$[0]"), Integer).label("product_id"),
+        cast(func.json_extract(cart_json.c.value, "$[1]"), Integer).label("quantity"),
+    ).cte("cart_lines")
+    return _fetch_cart_lines(cart_lines, cart_lines.c.position)
+
+
+def fetch_user_cart_lines(user_id: int) -> tuple[list[dict[str, object]], float]:
+    """Return the same lines and total as fetch_cart_lines for a user's saved cart.
+
+    The quantities are read from the cart table within the pricing query itself.
+    """
+
+    cart_lines = (
+        select(UserCartItem.product_id, UserCartItem.quantity)
+        .where(UserCartItem.user_id == user_id, UserCartItem.quantity > 0)
+        .cte("cart_lines")
+    )
+    return _fetch_cart_lines(cart_lines, cart_lines.c.product_id)
+
+
+def _fetch_cart_lines(cart_lines: CTE, order_by: ColumnElement[int]) -> tuple[list[dict[str, object]], float]:
+    """Price ``cart_lines`` (product_id, quantity) against the catalogue in one query."""
+
+    line_total_expr = Product.price * cart_lines.c.quantity
+
+    stmt, _, _ = _product_select()
+    stmt = (
+        stmt.add_columns(
+            cart_lines.c.quantity,
+            line_total_expr.label("line_total"),
+            func.sum(line_total_expr).over().label("cart_total"),
+        )
+        .join(cart_lines, cart_lines.c.product_id == Product.id)
+        .order_by(order_by)
+    )
+
+    with session_scope() as session:
+        rows = [dict(row) for row in session.execute(stmt).mappings().all()]
+    cart_total = _as_float(rows[0].pop("cart_total")) if rows else 0.0
+    for row in rows[1:]:
+        row.pop("cart_total", None)
+    return rows, cart_total
 
 
 def create_user(username: str, password_hash: str, *, is_admin: bool = False, is_seller: bool = False) -> int:
@@ -621,6 +774,26 @@ def delete_user(user_id: int) -> None:
 
     with session_scope() as session:
         session.execute(delete(User).where(User.id == user_id))
+    _bump_catalog_version()
+
+
+def delete_users(user_ids: Iterable[int]) -> None:
+    """Delete several users (and cascade related data) in one statement."""
+
+    normalized_ids = {_as_int(user_id) for user_id in user_ids}
+    normalized_ids.discard(0)
+    if not normalized_ids:
+        return
+    with session_scope() as session:
+        session.execute(delete(User).where(User.id.in_(normalized_ids)))
+    _bump_catalog_version()
+
+
+def update_user_password_hash(user_id: int, password_hash: str) -> None:
+    """Replace the stored password hash for a user."""
+
+    with session_scope() as session:
+        session.execute(update(User).where(User.id == user_id).values(password_hash=password_hash))
 
 
 def get_user_by_id(user_id: int) -> Optional[Mapping[str, object]]:
@@ -750,6 +923,91 @@ def fetch_seller_products(seller_id: int) -> list[Mapping[str, object]]:
     return list(fetch_products(seller_id=seller_id))
 
 
+def fetch_admin_dashboard() -> tuple[list[dict[str, object]], list[dict[str, object]]]:
+    """Return the admin dashboard's user cards and orders from a single session.
+
+    Both reads share one connection and one read transaction, so the page sees a
+    consistent snapshot.
+    """
+
+    with session_scope() as session:
+        return _dashboard_user_cards(session), _fetch_orders(session)
+
+
+def _dashboard_user_cards(session: Session) -> list[dict[str, object]]:
+    """Group users with their seller profile and products for the admin dashboard."""
+    stmt = (
+        select(
+            User.id.label("user_id"),
+            User.username,
+            User.created_at,
+            User.is_admin,
+            User.is_seller,
+            Seller.id.label("seller_id"),
+            Seller.store_name,
+            Seller.description.label("seller_description"),
+            Seller.contact_email,
+            Seller.created_at.label("seller_created_at"),
+            Product.id.label("product_id"),
+            Product.name.label("product_name"),
+            Product.brand,
+            Product.category,
+            Product.sku,
+            Product.price,
+            Product.inventory_count,
+        )
+        .join(Seller, User.seller_profile, isouter=True)
+        .join(Product, Product.seller_id == Seller.id, isouter=True)
+        .order_by(User.id.desc(), Product.id.desc())
+    )
+
+    rows = session.execute(stmt).mappings().all()
+
+    user_cards: list[dict[str, object]] = []
+    for user_id, user_rows in groupby(rows, key=lambda row: row["user_id"]):
+        rows_for_user = list(user_rows)
+        first = rows_for_user[0]
+        seller = None
+        if first["seller_id"] is not None:
+            seller = {
+                "id": first["seller_id"],
+                "user_id": user_id,
+                "store_name": first["store_name"],
+                "description": first["seller_description"],
+                "contact_email": first["contact_email"],
+                "created_at": first["seller_created_at"],
+                "username": first["username"],
+            }
+        products = [
+            {
+                "id": row["product_id"],
+                "name": row["product_name"],
+                "brand": row["brand"],
+                "category": row["category"],
+                "sku": row["sku"],
+                "price": row["price"],
+                "inventory_count": row["inventory_count"],
+                "seller_id": row["seller_id"],
+            }
+            for row in rows_for_user
+            if row["product_id"] is not None
+        ]
+        user_cards.append(
+            {
+                "user": {
+                    "id": user_id,
+                    "username": first["username"],
+                    "created_at": first["created_at"],
+                    "is_admin": first["is_admin"],
+                    "is_seller": first["is_seller"],
+                },
+                "seller": seller,
+                "products": products,
+            }
+        )
+    return user_cards
+
+
 def create_order(
     *,
     user_id: Optional[int] = None,
@@ -765,8 +1023,14 @@ def create_order(
     shipping_postal: str = "",
     shipping_country: str = "United States",
     items: Optional[Iterable[Mapping[str, object]]] = None,
+    decrement_inventory: bool = False,
 ) -> int:
-    """Insert an order snapshot for manual fulfilment tracking."""
+    """Insert an order snapshot for manual fulfilment tracking.
+
+    With ``decrement_inventory`` the ordered quantities are taken out of stock in the
+    same transaction, so an order never exists without its inventory change; if stock
+    ran out in the meantime, InsufficientStockError is raised and nothing is written.
+    """
 
     with session_scope() as session:
         order = Order(
@@ -785,6 +1049,7 @@ def create_order(
         )
         session.add(order)
         session.flush()
+        reserved: dict[int, int] = {}
         if items:
             for item in items:
                 product_name = str(item.get("product_name") or "").strip()
@@ -804,7 +1069,15 @@ def create_order(
                         unit_price=unit_price,
                     )
                 )
-        return int(order.id)
+                product_id = _as_int(item.get("product_id"))
+                if product_id:
+                    reserved[product_id] = reserved.get(product_id, 0) + quantity
+        if decrement_inventory:
+            _decrement_inventory(session, reserved)
+        order_id = int(order.id)
+    if decrement_inventory and reserved:
+        _bump_catalog_version()
+    return order_id
 
 
 def update_order(
@@ -953,6 +1226,11 @@ def _hydrate_orders(rows: Sequence[Mapping[str, object]], session: Session) -> l
 def fetch_orders() -> list[dict[str, object]]:
     """Return orders with denormalised customer/seller data."""
 
+    with session_scope() as session:
+        return _fetch_orders(session)
+
+
+def _fetch_orders(session: Session) -> list[dict[str, object]]:
     order_user = aliased(User)
     stmt = (
         select(
@@ -978,9 +1256,8 @@ def fetch_orders() -> list[dict[str, object]]:
         .join(order_user, Order.user_id == order_user.id, isouter=True)
         .order_by(Order.id.desc())
     )
-    with session_scope() as session:
-        rows = [dict(row) for row in session.execute(stmt).mappings().all()]
-        return _hydrate_orders(rows, session)
+    rows = [dict(row) for row in session.execute(stmt).mappings().all()]
+    return _hydrate_orders(rows, session)
 
 
 def fetch_orders_for_user(user_id: int) -> list[dict[str, object]]:
@@ -1049,6 +1326,77 @@ def delete_product(product_id: int) -> None:
 
     with session_scope() as session:
         session.execute(delete(Product).where(Product.id == product_id))
+    _bump_catalog_version()
+
+
+def delete_products(product_ids: Iterable[int]) -> None:
+    """Remove several products in one statement."""
+
+    normalized_ids = {_as_int(product_id) for product_id in product_ids}
+    normalized_ids.discard(0)
+    if not normalized_ids:
+        return
+    with session_scope() as session:
+        session.execute(delete(Product).where(Product.id.in_(normalized_ids)))
+    _bump_catalog_version()
+
+
+def bulk_increment_inventory(deltas: Mapping[int, int]) -> None:
+    """Add per-product quantities to inventory in a single UPDATE.
+
+    Negative stock is treated as zero before the quantity is added back.
+    """
+
+    normalized: dict[int, int] = {}
+    for product_id, delta in deltas.items():
+        pid = _as_int(product_id)
+        amount = _as_int(delta)
+        if pid and amount:
+            normalized[pid] = normalized.get(pid, 0) + amount
+    if not normalized:
+        return
+
+    stmt = (
+        update(Product)
+        .where(Product.id.in_(normalized))
+        .values(inventory_count=func.max(Product.inventory_count, 0) + case(normalized, value=Product.id, else_=0))
+        .execution_options(synchronize_session=False)
+    )
+    with session_scope() as session:
+        session.execute(stmt)
+    _bump_catalog_version()
+
+
+class InsufficientStockError(ValueError):
+    """Raised when an order asks for more units than are left in stock."""
+
+
+def _decrement_inventory(session: Session, deltas: Mapping[int, int]) -> None:
+    """Take per-product quantities out of stock in a single conditional UPDATE.
+
+    Rows only change when they still hold enough units, so concurrent checkouts cannot
+    oversell; if any product falls short the caller's transaction is aborted.
+    """
+
+    if not deltas:
+        return
+    requested = case(dict(deltas), value=Product.id, else_=0)
+    result = session.execute(
+        update(Product)
+        .where(Product.id.in_(deltas), Product.inventory_count >= requested)
+        .values(inventory_count=Product.inventory_count - requested)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(deltas):
+        raise InsufficientStockError("Some items in your cart no longer have enough stock.")
+
+
+def product_image_in_use(image_path: str) -> bool:
+    """Return True when any product still references the given image path."""
+
+    stmt = select(Product.id).where(Product.image_path == image_path).limit(1)
+    with session_scope() as session:
+        return session.execute(stmt).first() is not None
 
 
 def get_product(product_id: int) -> Optional[Mapping[str, object]]:
@@ -1085,6 +1433,7 @@ def upsert_product_review(product_id: int, user_id: int, rating: int, comment: s
                     comment=cleaned_comment,
                 )
             )
+    _bump_catalog_version()
 
 
 def fetch_product_reviews(product_id: int) -> Iterable[Mapping[str, object]]:
@@ -1108,39 +1457,17 @@ def fetch_product_reviews(product_id: int) -> Iterable[Mapping[str, object]]:
         return [dict(row) for row in rows]
 
 
-def get_user_review(product_id: int, user_id: int) -> Optional[Mapping[str, object]]:
-    """Return a specific user's review for a product if present."""
-
-    stmt = (
-        select(
-            ProductReview.id,
-            ProductReview.rating,
-            ProductReview.comment,
-            ProductReview.created_at,
-        )
-        .where(ProductReview.product_id == product_id, ProductReview.user_id == user_id)
-    )
-    with session_scope() as session:
-        row = session.execute(stmt).mappings().first()
-        return dict(row) if row else None
-
-
-def get_product_rating_summary(product_id: int) -> Mapping[str, float]:
-    """Return the average rating and total review count for a product."""
-
-    stmt = select(
-        func.coalesce(func.avg(ProductReview.rating), 0).label("avg_rating"),
-        func.count(ProductReview.id).label("review_count"),
-    ).where(ProductReview.product_id == product_id)
+def fetch_product_review_bundle(
+    product_id: int,
+    user_id: Optional[int] = None,
+) -> tuple[dict[str, float], list[Mapping[str, object]], Optional[Mapping[str, object]]]:
+    """Return the rating summary, newest-first reviews, and the user's own review in one query."""
 
-    with session_scope() as session:
-        row = session.execute(stmt).mappings().first()
-    if not row:
-        return {"avg_rating": 0.0, "review_count": 0}
-    return {
-        "avg_rating": float(row["avg_rating"]),
-        "review_count": int(row["review_count"]),
-    }
+    reviews = list(fetch_product_reviews(product_id))
+    review_count = len(reviews)
+    avg_rating = sum(_as_int(review["rating"]) for review in reviews) / review_count if review_count else 0.0
+    user_review = next((review for review in reviews if user_id and review["user_id"] == user_id), None)
+    return {"avg_rating": float(avg_rating), "review_count": review_count}, reviews, user_review
 
 
 def upsert_recent_product_view(user_id: int, product_id: int, max_items: int = 10) -> None:
@@ -1225,3 +1552,4 @@ def update_product(
             product.image_path = image_path
         if category is not None:
             product.category = category
+    _bump_catalog_version()
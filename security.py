@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
@@ -12,12 +13,21 @@ from cryptography.fernet import Fernet, InvalidToken
 from werkzeug.security import check_password_hash
 
 BCRYPT_ROUNDS = 12
+# bcrypt only reads the first 72 bytes of a password (newer releases reject longer input).
+PASSWORD_MAX_BYTES = 72
 SENSITIVE_KEY_ENV = "SENSITIVE_DATA_KEY"
 SENSITIVE_KEY_FILE = Path(__file__).with_name("sensitive_key.txt")
+COMMON_PASSWORDS = frozenset({"password", "password1", "letmein", "1234", "12345", "123456", "qwerty"})
+REPEATED_CHARACTER_PATTERN = re.compile(r"(.)\1{2,}")
+USERNAME_PASSWORD_SUFFIXES = ("123", "1", "01")
 
 _sensitive_key_cache: Optional[bytes] = None
 _sensitive_cipher: Optional[Fernet] = None
 
+# bcrypt releases the GIL while hashing, so a pool sized to the CPU count lets
+# concurrent logins run in parallel without oversubscribing the cores.
+_HASH_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="password-hash")
+
 
 def hash_password(password: str) -> str:
     """Hash the provided password using bcrypt with a per-password salt."""
@@ -25,7 +35,7 @@ def hash_password(password: str) -> str:
     if not isinstance(password, str):
         raise TypeError("Password must be a string.")
     salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
-    hashed = bcrypt.hashpw(password.encode("utf-8"), salt)
+    hashed = _HASH_POOL.submit(bcrypt.hashpw, password.encode("utf-8"), salt).result()
     return hashed.decode("utf-8")
 
 
@@ -41,30 +51,65 @@ def verify_password(password: str, stored_hash: str | bytes | None) -> bool:
         return check_password_hash(stored_hash_str, password)
 
     try:
-        return bcrypt.checkpw(password.encode("utf-8"), stored_hash_str.encode("utf-8"))
+        return _HASH_POOL.submit(bcrypt.checkpw, password.encode("utf-8"), stored_hash_str.encode("utf-8")).result()
     except (ValueError, TypeError):
         return False
 
 
+def password_needs_rehash(stored_hash: str | bytes | None) -> bool:
+    """Return True when a stored hash was produced by an older hashing policy."""
+
+    if not stored_hash:
+        return False
+
+    stored_hash_str = stored_hash.decode("utf-8") if isinstance(stored_hash, bytes) else str(stored_hash)
+
+    if stored_hash_str.startswith("scrypt:") or stored_hash_str.startswith("pbkdf2:"):
+        return True
+
+    # bcrypt hashes look like $2b$<rounds>$<salt+digest>.
+    parts = stored_hash_str.split("$")
+    if len(parts) < 4 or not parts[2].isdigit():
+        return False
+    return int(parts[2]) != BCRYPT_ROUNDS
+
+
+# Built at import so no login request ever pays for generating it.
+_DUMMY_PASSWORD_HASH = hash_password(os.urandom(16).hex())
+
+
+def verify_login(password: str, stored_hash: str | bytes | None) -> bool:
+    """Check a login attempt, hashing against a dummy when there is no account to check."""
+
+    # Always run a bcrypt check so unknown usernames take as long as wrong passwords.
+    if not stored_hash:
+        verify_password(password, _DUMMY_PASSWORD_HASH)
+        return False
+    return verify_password(password, stored_hash)
+
+
 def validate_password(username: str, password: str) -> str | None:
     """Return an error message if the password fails policy checks, otherwise None."""
 
-    lowered = password.lower()
-    username_lower = username.lower()
-
+    # Length checks come first so oversized input is rejected before any scanning.
     if len(password) < 8:
         return "Password must be at least eight characters."
-    if lowered in {"password", "password1", "letmein", "1234", "12345", "123456", "qwerty"}:
+    if len(password) > PASSWORD_MAX_BYTES or len(password.encode("utf-8")) > PASSWORD_MAX_BYTES:
+        return f"Password must be at most {PASSWORD_MAX_BYTES} bytes long."
+
+    lowered = password.lower()
+    username_lower = username.lower()
+    if lowered in COMMON_PASSWORDS:
         return "Please choose a less common password."
     if lowered == username_lower:
         return "Password cannot match the username."
-    if lowered in {f"{username_lower}{d}" for d in ("123", "1", "01")}:
+    if lowered.startswith(username_lower) and lowered[len(username_lower) :] in USERNAME_PASSWORD_SUFFIXES:
         return "Password is too closely related to the username."
     if lowered.isdigit():
         return "Password must include letters in addition to numbers."
     if lowered.isalpha():
         return "Password must include at least one number or symbol."
-    if re.match(r"(.)\1{2,}", lowered):
+    if REPEATED_CHARACTER_PATTERN.search(lowered):
         return "Password cannot contain the same character repeated three or more times consecutively."
 
     return None
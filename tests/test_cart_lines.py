@@ -0,0 +1,72 @@
+"""Regression tests for pricing carts in a single query."""
+
+from __future__ import annotations
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from sqlalchemy import create_engine
+
+import database
+from database import Base, Product, session_scope
+
+
+class FetchCartLinesTest(unittest.TestCase):
+    """Run fetch_cart_lines against a throwaway database instead of store.db."""
+
+    product_count = 600
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls._tempdir = tempfile.TemporaryDirectory()
+        cls._original_engine = database.engine
+        cls.engine = create_engine(f"sqlite:///{Path(cls._tempdir.name) / 'store.db'}", future=True)
+        database.engine = cls.engine
+        database.SessionLocal.configure(bind=cls.engine)
+        Base.metadata.create_all(bind=cls.engine)
+
+        with session_scope() as session:
+            products = [
+                Product(name=f"Part {index}", description="Test part", price=float(index % 7 + 1))
+                for index in range(cls.product_count)
+            ]
+            session.add_all(products)
+            session.flush()
+            cls.product_ids = [product.id for product in products]
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        database.SessionLocal.configure(bind=cls._original_engine)
+        database.engine = cls._original_engine
+        cls.engine.dispose()
+        cls._tempdir.cleanup()
+
+    def test_prices_carts_beyond_sqlite_compound_select_limit(self) -> None:
+        # SQLite caps a compound SELECT at 500 terms, so this cart must not become a UNION ALL.
+        cart = {product_id: index % 3 + 1 for index, product_id in enumerate(reversed(self.product_ids))}
+
+        lines, total = database.fetch_cart_lines(cart)
+
+        self.assertEqual([line["id"] for line in lines], list(cart))
+        self.assertEqual([line["quantity"] for line in lines], list(cart.values()))
+        expected_total = sum(float(line["price"]) * int(line["quantity"]) for line in lines)
+        self.assertAlmostEqual(total, expected_total)
+        for line in lines:
+            self.assertAlmostEqual(float(line["line_total"]), float(line["price"]) * int(line["quantity"]))
+
+    def test_skips_empty_lines_and_unknown_products(self) -> None:
+        first, second = self.product_ids[:2]
+        cart = {second: 2, 10_000_000: 1, first: 0}
+
+        lines, total = database.fetch_cart_lines(cart)
+
+        self.assertEqual([(line["id"], line["quantity"]) for line in lines], [(second, 2)])
+        self.assertAlmostEqual(total, float(lines[0]["price"]) * 2)
+
+    def test_empty_cart(self) -> None:
+        self.assertEqual(database.fetch_cart_lines({}), ([], 0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()